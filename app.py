@@ -1,11 +1,20 @@
+import io
 import os
+import hashlib
+import re
+import uuid
 import logging
 import time
-from flask import Flask, request, render_template_string, send_file
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from openpyxl import load_workbook
+from flask import Flask, Request, Response, request, render_template_string, send_file, url_for
+from werkzeug.utils import secure_filename
 from datetime import datetime
 from pathlib import Path
 import tempfile
-from urllib.parse import unquote # Keep this for parsing if needed, though direct upload simplifies
+from urllib.parse import quote, unquote # Keep this for parsing if needed, though direct upload simplifies
 
 # Import your custom modules
 import config
@@ -21,12 +30,74 @@ logging.basicConfig(
 
 app = Flask(__name__)
 
+def _get_temp_dir() -> Path:
+    """
+    Returns the directory for uploaded, intermediate and generated files. Every Gunicorn worker must
+    resolve the same directory, since job state is shared through files there, so it is decided by
+    configuration rather than by probing free space: APP_DATA_DIR if set, otherwise the RAM-backed
+    /dev/shm when the container has one, otherwise the system temp directory.
+    """
+    configured = os.environ.get("APP_DATA_DIR")
+    if configured:
+        return Path(configured)
+    if os.path.isdir("/dev/shm"):
+        return Path("/dev/shm") / "app_data"
+    return Path(tempfile.gettempdir()) / "app_data"
+
 # Define a temporary directory for file operations within the container
 # This will be used for uploaded Excel and generated PowerPoint files
-TEMP_DIR = Path(tempfile.gettempdir()) / "app_data"
+TEMP_DIR = _get_temp_dir()
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
 logging.info(f"Temporary application data directory: {TEMP_DIR}")
 
+# When set (e.g. "/internal"), finished PowerPoints are handed to an nginx front end via
+# X-Accel-Redirect instead of being streamed by the Gunicorn worker. nginx must map that
+# prefix to TEMP_DIR in an internal location, e.g. with the default APP_DATA_DIR on /dev/shm
+#   location /internal/ { internal; alias /dev/shm/app_data/; }
+X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX", "").rstrip("/")
+
+# Reject request bodies larger than this before they are read
+app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
+
+# Extensions an upload may be stored under; anything else is stored as .xlsm
+ALLOWED_UPLOAD_SUFFIXES = {".xlsm", ".xlsx"}
+
+class HashingSpoolFile:
+    """Wraps a spooled upload file and hashes the bytes written to it, so uploads are content-addressed without a second read."""
+    def __init__(self, file):
+        self.file = file
+        self.hasher = hashlib.blake2b(digest_size=16)
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+class UploadRequest(Request):
+    """Request that streams uploaded files straight into TEMP_DIR rather than buffering them in memory first."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_streams = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = HashingSpoolFile(tempfile.NamedTemporaryFile(dir=TEMP_DIR, prefix="upload-", suffix=".part", delete=False))
+        self.upload_streams.append(stream)
+        return stream
+
+app.request_class = UploadRequest
+
+@app.teardown_request
+def remove_unclaimed_uploads(exc):
+    """Deletes spooled upload files that the view did not move into a job directory."""
+    for stream in request.upload_streams:
+        stream.close()
+        Path(stream.name).unlink(missing_ok=True)
+
 # HTML for the simple upload form
 UPLOAD_FORM_HTML = """
 <!doctype html>
@@ -41,15 +112,235 @@ UPLOAD_FORM_HTML = """
 {% endif %}
 """
 
+# Page shown while a job is running; refreshes itself until the PowerPoint is ready
+JOB_PENDING_HTML = """
+<!doctype html>
+<title>Excel to PowerPoint Automation</title>
+<meta http-equiv="refresh" content="3;url={{ result_url }}">
+<h1>Processing...</h1>
+<p>Your PowerPoint is being generated. This page will download it when it is ready.</p>
+<p><a href="{{ result_url }}">Check again</a></p>
+"""
+
+# Background pipeline jobs. Job state lives in files under TEMP_DIR/<job_id> so that any
+# Gunicorn worker process can answer the result poll, not just the one that ran the job.
+pipeline_executor = ThreadPoolExecutor(max_workers=2)
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+JOB_STARTED_FILENAME = "started.txt"
+JOB_DONE_FILENAME = "done.txt"
+JOB_ERROR_FILENAME = "error.txt"
+
+# A job that has written neither its done nor its error file this long after it was queued is
+# assumed lost (e.g. the worker running it crashed or was restarted) and reported as failed
+JOB_TIMEOUT_SECONDS = 15 * 60
+
+# How long files are kept in TEMP_DIR. Job directories (and any abandoned upload spool
+# files) only need to outlive the result poll; stored uploads and their preprocessed
+# workbooks are kept longer so re-running the same report can reuse them.
+JOB_RETENTION_SECONDS = 60 * 60
+CACHE_RETENTION_SECONDS = 24 * 60 * 60
+
+# Upper bound on the space taken by stored uploads and preprocessed workbooks (TEMP_DIR is
+# usually RAM-backed). When exceeded, the least recently used ones are removed first.
+CACHE_MAX_BYTES = int(os.environ.get("APP_DATA_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+def remove_stale_files():
+    """
+    Deletes job directories, spool files and cached workbooks in TEMP_DIR that are past their
+    retention period, then trims the cached workbooks down to CACHE_MAX_BYTES.
+    """
+    now = time.time()
+    cached_files = [] # (mtime, size, path) of the stored uploads and preprocessed workbooks that are kept
+    with os.scandir(TEMP_DIR) as entries:
+        for entry in entries:
+            try:
+                stat = entry.stat(follow_symlinks=False)
+                age = now - stat.st_mtime
+                if entry.is_dir(follow_symlinks=False):
+                    if JOB_ID_PATTERN.fullmatch(entry.name) and age > JOB_RETENTION_SECONDS:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                elif entry.name.endswith(".part"):
+                    if age > JOB_RETENTION_SECONDS:
+                        os.unlink(entry.path)
+                elif age > CACHE_RETENTION_SECONDS:
+                    os.unlink(entry.path)
+                else:
+                    cached_files.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError as e:
+                # Another worker may be removing the same entry
+                logging.warning(f"Could not remove stale temp entry '{entry.path}': {e}")
+
+    cache_size = sum(size for _, size, _ in cached_files)
+    for mtime, size, path in sorted(cached_files):
+        if cache_size <= CACHE_MAX_BYTES:
+            break
+        if now - mtime <= JOB_TIMEOUT_SECONDS:
+            # Recently used files may still be read by a queued or running job
+            break
+        try:
+            os.unlink(path)
+            cache_size -= size
+        except OSError as e:
+            logging.warning(f"Could not remove cached temp file '{path}': {e}")
+
+# Define the base template for table regions (as in your original main.py)
+BASE_REGIONS = {
+    "Exec View": [
+        ("C3", "E13"), ("F3", "F13"),
+        ("C18", "E24"), ("F18", "F24"), ("H18", "H18"), ("H20", "H22"),
+        ("C29", "E36"), ("F29", "F36"), ("H29", "H29"), ("H31", "H33"),
+        ("K3", "K3"), ("K4", "N13"), ("O3", "O3"), ("R4", "R13"),
+        ("S3", "S3"), ("V4", "V13"), ("W3", "W3"), ("W4", "W13"),
+    ],
+    "Comparisons": [
+        ("K3", "K3"), ("K4", "N13"), ("S3", "S13"), ("T3", "T3"),
+        ("W4", "W13"), ("X3", "X13"), ("AC3", "AC13"), ("AD3", "AD3"),
+        ("AG4", "AG13"), ("AH3", "AH13"), ("AM3", "AM13"), ("AN3", "AN3"), ("AQ4", "AQ13"),
+        ("AR3", "AR13"),
+    ],
+    "Commit": [
+        ("C3", "C3"), ("C4", "F13"), ("G3", "G3"), ("J4", "J13"),
+        ("K3", "K3"), ("N4", "N13"), ("O3", "O3"), ("R4", "R13"),
+        ("S3", "S3"), ("V4", "V13"),
+    ],
+    "Margins Scenarios": [
+        ("B15", "B15"), ("B16", "G19"), ("B20", "G20"), ("B25", "B25"),
+        ("B26", "G29"), ("B30", "G30"), ("B32", "B32"), ("B33", "G36"),
+        ("B37", "G37"), ("B39", "B39"), ("B40", "G43"), ("B44", "G44"),
+        ("B46", "B46"), ("B47", "G50"), ("B51", "G51"), ("I39", "I39"),
+        ("I40", "N43"), ("I44", "N44"),
+    ],
+}
+
+# The regions decoded to numeric (row_start, col_start, row_end, col_end) bounds, and the cells they
+# cover per base sheet name; both are fixed, so they are computed once at import rather than per upload
+BASE_REGION_BOUNDS = {base: excel_processor.region_bounds(regions) for base, regions in BASE_REGIONS.items()}
+BASE_WANTED_CELLS = {base: excel_processor.expand_region_cells(bounds) for base, bounds in BASE_REGION_BOUNDS.items()}
+
+# Order in which the sheets' tables are fed to the PowerPoint update
+DESIRED_ORDER_BASES = ["Exec View", "Comparisons", "Commit", "Margins Scenarios"]
+
 @app.route('/')
 def index():
     """Serves the main upload form page."""
     return render_template_string(UPLOAD_FORM_HTML)
 
+def run_pipeline(input_excel_path: Path, job_dir: Path) -> Path:
+    """
+    Preprocesses an uploaded Excel file and generates the PowerPoint from it.
+    input_excel_path is content-addressed (named after the upload's hash), so the preprocessed
+    workbook is cached next to it and reused when the same file is uploaded again in the same
+    fiscal month. The PowerPoint is written to job_dir. Returns the PowerPoint path.
+    """
+    start_time = time.time()
+
+    current_date = datetime.now()
+    fiscal_year, fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str = utils.get_fiscal_quarter_and_month(current_date.date())
+    logging.info(f"Current fiscal period: {fiscal_quarter_str} {fiscal_month_overall_str} (Month in Q: {fiscal_month_in_quarter_str})")
+
+    # Dynamically determine the required sheet names once; they drive both preprocessing and the PPT update
+    required_sheets = utils.find_dynamic_sheets(excel_processor.read_sheet_names(input_excel_path), fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str)
+    logging.info(f"Sheets identified for processing: {required_sheets}")
+
+    # Step 1: Preprocess the Excel file
+    # The sheets that are kept depend on the fiscal month, so it is part of the cache key
+    cached_preprocessed_path = input_excel_path.with_name(f"{input_excel_path.stem}.{fiscal_quarter_str}{fiscal_month_overall_str}.preprocessed.xlsx")
+    wb_data_only = None
+    if cached_preprocessed_path.exists():
+        logging.info(f"Reusing preprocessed workbook {cached_preprocessed_path}")
+        try:
+            os.utime(cached_preprocessed_path) # Keep it from being swept while it is still in use
+            wb_data_only = load_workbook(cached_preprocessed_path, data_only=True, read_only=True)
+            preprocessed_excel = cached_preprocessed_path
+        except (zipfile.BadZipFile, OSError) as e:
+            # A damaged or vanished cache entry is dropped and rebuilt below
+            logging.warning(f"Discarding unreadable preprocessed workbook {cached_preprocessed_path}: {e}")
+            cached_preprocessed_path.unlink(missing_ok=True)
+
+    if wb_data_only is None:
+        # Preprocess in memory and load from that buffer; the cache copy is written for later uploads only
+        preprocessed_excel = io.BytesIO()
+        logging.info(f"Starting preprocessing of {input_excel_path} (in memory)")
+        preprocessed_ok = excel_processor.preprocess_excel_xml(input_excel_path, preprocessed_excel, required_sheets, BASE_WANTED_CELLS)
+        logging.info("Excel preprocessing completed.")
+        preprocessed_excel.seek(0)
+        # Load the preprocessed Excel file (data_only=True)
+        wb_data_only = load_workbook(preprocessed_excel, data_only=True, read_only=True)
+
+        # Only a complete workbook that has just loaded cleanly is cached for later uploads
+        if preprocessed_ok:
+            partial_path = cached_preprocessed_path.with_name(f"{cached_preprocessed_path.name}.{uuid.uuid4().hex}.part")
+            try:
+                partial_path.write_bytes(preprocessed_excel.getvalue())
+                os.replace(partial_path, cached_preprocessed_path)
+            except OSError as e:
+                # The cache is best-effort; the deck is still built from the in-memory buffer
+                logging.warning(f"Could not cache preprocessed workbook at {cached_preprocessed_path}: {e}")
+                partial_path.unlink(missing_ok=True)
+        else:
+            logging.warning("Preprocessing reported errors; the preprocessed workbook will not be cached.")
+
+    sheet_names = wb_data_only.sheetnames
+    logging.info(f"Sheets in preprocessed Excel: {sheet_names}")
+
+    # Dynamic PowerPoint filename generation
+    fiscal_year_short = str(fiscal_year)[2:]
+    dynamic_filename_part = f"{fiscal_month_in_quarter_str} {fiscal_quarter_str}FY{fiscal_year_short}"
+    new_ppt_filename = f"{dynamic_filename_part} P&L Review_Cisco Highly Confidential _WD-1 DRAFT.pptx"
+    dynamic_final_output_ppt_path = job_dir / new_ppt_filename # Ensure output is in the job's directory
+    logging.info(f"Dynamic final PowerPoint output path set to: '{dynamic_final_output_ppt_path}'.")
+
+    # Preprocessing skips empty sheets, so only keep the required sheets that made it into the workbook
+    identified_sheets = [s for s in required_sheets if s in sheet_names]
+    logging.info(f"Sheets identified for PPT update: {identified_sheets}")
+
+    # Map dynamically identified sheets to their base names, in the desired order
+    base_to_sheet = utils.map_sheets_to_bases(identified_sheets, DESIRED_ORDER_BASES)
+    missing_bases = [base for base in DESIRED_ORDER_BASES if base not in base_to_sheet]
+    for base in missing_bases:
+        logging.warning(f"Sheet matching base name '{base}' not found for PPT update. It will be skipped.")
+    ordered_sheets = list(base_to_sheet.values())
+
+    logging.info(f"Ordered sheets for PPT update: {ordered_sheets}")
+
+    if missing_bases:
+        logging.critical(f"Missing critical sheets for PPT update: {', '.join(missing_bases)}. Ensure the source file is correct and named as expected.")
+        # You might want to raise an error here instead of proceeding
+        # raise ValueError(f"Missing critical sheets: {', '.join(missing_bases)}")
+
+    table_regions = {sheet_name: BASE_REGIONS[base] for base, sheet_name in base_to_sheet.items()}
+
+    logging.info("Loading tables from preprocessed Excel for PowerPoint update...")
+    tables = ppt_updater.load_tables_from_excel(preprocessed_excel, table_regions.keys(), table_regions, wb_data_only)
+    logging.info("Tables loaded successfully.")
+
+    # Step 3: Update the PowerPoint presentation
+    logging.info("Updating PowerPoint presentation...")
+    ppt_updater.update_ppt_labels(str(config.PPT_TEMPLATE_FILENAME), str(dynamic_final_output_ppt_path), tables)
+    logging.info(f"PowerPoint updated and saved to {dynamic_final_output_ppt_path}")
+
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    logging.info(f"Script completed in {elapsed_time:.2f} seconds.")
+
+    return dynamic_final_output_ppt_path
+
+def _run_job(job_id: str, input_excel_path: Path):
+    """Runs the pipeline for a job in the background and records its outcome in the job directory."""
+    job_dir = TEMP_DIR / job_id
+    try:
+        output_ppt_path = run_pipeline(input_excel_path, job_dir)
+        (job_dir / JOB_DONE_FILENAME).write_text(output_ppt_path.name, encoding="utf-8")
+    except Exception as e:
+        logging.error(f"An error occurred during PowerPoint generation for job {job_id}: {e}", exc_info=True)
+        (job_dir / JOB_ERROR_FILENAME).write_text(str(e), encoding="utf-8")
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Handles the uploaded Excel file, processes it, and returns a PowerPoint."""
-    start_time = time.time()
+    """
+    Handles the uploaded Excel file and queues it for processing.
+    Responds with 202 and the URL to poll for the generated PowerPoint.
+    """
     logging.info('Received file upload request.')
 
     # Check if a file was uploaded
@@ -66,129 +357,83 @@ def upload_file():
         return render_template_string(UPLOAD_FORM_HTML, message="No selected file!"), 400
 
     if excel_file:
-        # Securely save the uploaded file to a temporary location
-        # Use a sanitized filename to prevent path traversal issues
-        original_filename = excel_file.filename
-        # For simplicity, just use the original filename, but in production,
-        # consider using werkzeug.utils.secure_filename
-        temp_input_excel_path = TEMP_DIR / original_filename
-        excel_file.save(temp_input_excel_path)
-        logging.info(f"Excel file saved to: {temp_input_excel_path}")
+        remove_stale_files()
+
+        job_id = uuid.uuid4().hex
+        job_dir = TEMP_DIR / job_id
+        job_dir.mkdir()
+        # Its mtime records when the job was queued, so polls can detect a job whose worker died
+        (job_dir / JOB_STARTED_FILENAME).write_text(datetime.now().isoformat(), encoding="utf-8")
+
+        # The client's filename is only used for its extension and for logging; the upload
+        # is stored under its content hash so identical uploads share one file (and its cache)
+        original_filename = secure_filename(excel_file.filename)
+        # Only known workbook extensions are kept, so a crafted name (e.g. "*.part") cannot change how the sweep treats the file
+        suffix = Path(original_filename).suffix.lower()
+        if suffix not in ALLOWED_UPLOAD_SUFFIXES:
+            suffix = ".xlsm"
+        temp_input_excel_path = TEMP_DIR / f"{excel_file.stream.hexdigest()}{suffix}"
+        excel_file.stream.close()
+        if temp_input_excel_path.exists():
+            # Same content was uploaded before; the spooled copy is removed on teardown
+            os.utime(temp_input_excel_path) # Restart its retention period
+            logging.info(f"Excel file already stored at: {temp_input_excel_path}")
+        else:
+            # The upload is already on disk in TEMP_DIR, so a rename is enough to claim it
+            os.replace(excel_file.stream.name, temp_input_excel_path)
+            logging.info(f"Excel file saved to: {temp_input_excel_path}")
+
+        # Run the CPU-bound pipeline off the request thread so the worker can keep serving requests
+        pipeline_executor.submit(_run_job, job_id, temp_input_excel_path)
+        logging.info(f"Queued job {job_id} for {original_filename}")
+
+        result_url = url_for('get_result', job_id=job_id)
+        return render_template_string(JOB_PENDING_HTML, result_url=result_url), 202, {"Location": result_url}
 
-        try:
-            # --- Main Logic (adapted from your function_app.py) ---
-
-            # Step 1: Preprocess the Excel file
-            # Note: excel_processor.preprocess_excel_xml saves to config.TARGET_EXCEL_FILENAME
-            # We need to ensure config.TARGET_EXCEL_FILENAME is also within TEMP_DIR
-            config.TARGET_EXCEL_FILENAME = TEMP_DIR / "preprocessed_data.xlsx"
-            logging.info(f"Starting preprocessing of {temp_input_excel_path} to {config.TARGET_EXCEL_FILENAME}")
-            excel_processor.preprocess_excel_xml(temp_input_excel_path, config.TARGET_EXCEL_FILENAME)
-            logging.info("Excel preprocessing completed.")
-
-            # Load the preprocessed Excel file (data_only=True)
-            from openpyxl import load_workbook # Import here to avoid potential circular dependency issues
-            wb_data_only = load_workbook(config.TARGET_EXCEL_FILENAME, data_only=True, read_only=True)
-            sheet_names = wb_data_only.sheetnames
-            logging.info(f"Sheets in preprocessed Excel: {sheet_names}")
-
-            current_date = datetime.now()
-            fiscal_year, fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str = utils.get_fiscal_quarter_and_month(current_date.date())
-            logging.info(f"Current fiscal period for PPT update: {fiscal_quarter_str} {fiscal_month_overall_str} (Month in Q: {fiscal_month_in_quarter_str})")
-
-            # Dynamic PowerPoint filename generation
-            fiscal_year_short = str(fiscal_year)[2:]
-            dynamic_filename_part = f"{fiscal_month_in_quarter_str} {fiscal_quarter_str}FY{fiscal_year_short}"
-            new_ppt_filename = f"{dynamic_filename_part} P&L Review_Cisco Highly Confidential _WD-1 DRAFT.pptx"
-            dynamic_final_output_ppt_path = TEMP_DIR / new_ppt_filename # Ensure output is in TEMP_DIR
-            logging.info(f"Dynamic final PowerPoint output path set to: '{dynamic_final_output_ppt_path}'.")
-
-            # Dynamically determine the required sheet names for PPT update
-            identified_sheets = utils.find_dynamic_sheets(sheet_names, fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str)
-            logging.info(f"Sheets identified for PPT update: {identified_sheets}")
-
-            # Define the desired order of sheets for table processing
-            desired_order_bases = ["Exec View", "Comparisons", "Commit", "Margins Scenarios"]
-            ordered_sheets = []
-
-            # Map dynamically identified sheets to their corresponding positions in the desired order
-            for desired_base_name in desired_order_bases:
-                matched_sheet = next((s for s in identified_sheets if desired_base_name in s), None)
-                if matched_sheet:
-                    ordered_sheets.append(matched_sheet)
-                else:
-                    logging.warning(f"Sheet matching base name '{desired_base_name}' not found for PPT update. It will be skipped.")
-
-            logging.info(f"Ordered sheets for PPT update: {ordered_sheets}")
-
-            if len(ordered_sheets) < len(desired_order_bases):
-                missing_bases = set(desired_order_bases) - set(s.split(' ', 1)[-1] if ' ' in s else s for s in ordered_sheets)
-                logging.critical(f"Missing critical sheets for PPT update: {', '.join(missing_bases)}. Ensure the source file is correct and named as expected.")
-                # You might want to return an error here instead of proceeding
-                # return render_template_string(UPLOAD_FORM_HTML, message=f"Missing critical sheets: {', '.join(missing_bases)}"), 500
-
-
-            # Define the base template for table regions (as in your original main.py)
-            base_regions = {
-                "Exec View": [
-                    ("C3", "E13"), ("F3", "F13"),
-                    ("C18", "E24"), ("F18", "F24"), ("H18", "H18"), ("H20", "H22"),
-                    ("C29", "E36"), ("F29", "F36"), ("H29", "H29"), ("H31", "H33"),
-                    ("K3", "K3"), ("K4", "N13"), ("O3", "O3"), ("R4", "R13"),
-                    ("S3", "S3"), ("V4", "V13"), ("W3", "W3"), ("W4", "W13"),
-                ],
-                "Comparisons": [
-                    ("K3", "K3"), ("K4", "N13"), ("S3", "S13"), ("T3", "T3"),
-                    ("W4", "W13"), ("X3", "X13"), ("AC3", "AC13"), ("AD3", "AD3"),
-                    ("AG4", "AG13"), ("AH3", "AH13"), ("AM3", "AM13"), ("AN3", "AN3"), ("AQ4", "AQ13"),
-                    ("AR3", "AR13"),
-                ],
-                "Commit": [
-                    ("C3", "C3"), ("C4", "F13"), ("G3", "G3"), ("J4", "J13"),
-                    ("K3", "K3"), ("N4", "N13"), ("O3", "O3"), ("R4", "R13"),
-                    ("S3", "S3"), ("V4", "V13"),
-                ],
-                "Margins Scenarios": [
-                    ("B15", "B15"), ("B16", "G19"), ("B20", "G20"), ("B25", "B25"),
-                    ("B26", "G29"), ("B30", "G30"), ("B32", "B32"), ("B33", "G36"),
-                    ("B37", "G37"), ("B39", "B39"), ("B40", "G43"), ("B44", "G44"),
-                    ("B46", "B46"), ("B47", "G50"), ("B51", "G51"), ("I39", "I39"),
-                    ("I40", "N43"), ("I44", "N44"),
-                ],
-            }
-
-            table_regions = {}
-            for sheet_name in ordered_sheets:
-                base_sheet_name = next((k for k in base_regions if k in sheet_name), None)
-                if base_sheet_name:
-                    table_regions[sheet_name] = base_regions[base_sheet_name]
-
-            logging.info("Loading tables from preprocessed Excel for PowerPoint update...")
-            tables = ppt_updater.load_tables_from_excel(str(config.TARGET_EXCEL_FILENAME), table_regions.keys(), table_regions, wb_data_only)
-            logging.info("Tables loaded successfully.")
-
-            # Step 3: Update the PowerPoint presentation
-            logging.info("Updating PowerPoint presentation...")
-            ppt_updater.update_ppt_labels(str(config.PPT_TEMPLATE_FILENAME), str(dynamic_final_output_ppt_path), tables)
-            logging.info(f"PowerPoint updated and saved to {dynamic_final_output_ppt_path}")
-
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            logging.info(f"Script completed in {elapsed_time:.2f} seconds.")
-
-            # Return the generated PowerPoint file for download
-            return send_file(str(dynamic_final_output_ppt_path),
-                             mimetype='application/vnd.openxmlformats-officedocument.presentationml.presentation',
-                             as_attachment=True,
-                             download_name=new_ppt_filename)
-
-        except Exception as e:
-            logging.error(f"An error occurred during PowerPoint generation: {e}", exc_info=True)
-            return render_template_string(UPLOAD_FORM_HTML, message=f"An error occurred: {e}"), 500
-    
     # Fallback if no file was processed (should not be reached with checks above)
     return render_template_string(UPLOAD_FORM_HTML, message="Something went wrong with the file upload."), 500
 
+@app.route('/result/<job_id>')
+def get_result(job_id):
+    """Returns the generated PowerPoint once the job has finished, or 202 while it is still running."""
+    job_dir = TEMP_DIR / job_id
+    if not JOB_ID_PATTERN.fullmatch(job_id) or not job_dir.is_dir():
+        return render_template_string(UPLOAD_FORM_HTML, message="Unknown job."), 404
+
+    error_file = job_dir / JOB_ERROR_FILENAME
+    if error_file.exists():
+        return render_template_string(UPLOAD_FORM_HTML, message=f"An error occurred: {error_file.read_text(encoding='utf-8')}"), 500
+
+    done_file = job_dir / JOB_DONE_FILENAME
+    if not done_file.exists():
+        try:
+            started_at = (job_dir / JOB_STARTED_FILENAME).stat().st_mtime
+        except FileNotFoundError:
+            started_at = job_dir.stat().st_mtime
+        if time.time() - started_at > JOB_TIMEOUT_SECONDS:
+            logging.error(f"Job {job_id} did not finish within {JOB_TIMEOUT_SECONDS} seconds; assuming it was lost.")
+            return render_template_string(UPLOAD_FORM_HTML, message="An error occurred: the job did not finish in time. Please upload the file again."), 500
+        result_url = url_for('get_result', job_id=job_id)
+        return render_template_string(JOB_PENDING_HTML, result_url=result_url), 202
+
+    # Return the generated PowerPoint file for download
+    new_ppt_filename = done_file.read_text(encoding="utf-8")
+    mimetype = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+    if X_ACCEL_REDIRECT_PREFIX:
+        # Let nginx serve the file so the worker is free as soon as the headers are sent
+        response = Response(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = f"{X_ACCEL_REDIRECT_PREFIX}/{job_id}/{quote(new_ppt_filename)}"
+        response.headers.set("Content-Disposition", "attachment", filename=new_ppt_filename)
+        return response
+
+    # conditional/etag let clients resume or revalidate the download with Range/If-None-Match
+    return send_file(str(job_dir / new_ppt_filename),
+                     mimetype=mimetype,
+                     as_attachment=True,
+                     download_name=new_ppt_filename,
+                     conditional=True,
+                     etag=True)
+
 if __name__ == '__main__':
     # For local testing, CAE will run this with Gunicorn
     app.run(debug=True, host='0.0.0.0', port=5000) # Use 5000 for local Flask dev server
\ No newline at end of file
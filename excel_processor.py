@@ -1,70 +1,110 @@
 import zipfile
-import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree as ET
 import logging
-from typing import Set, List, Dict, Tuple, Any
+from typing import Set, List, Dict, Tuple, Any, Optional, Union, BinaryIO
 from openpyxl import Workbook
-from datetime import datetime
+from openpyxl.utils import get_column_letter
 
-from utils import coordinate_to_tuple, find_dynamic_sheets, get_fiscal_quarter_and_month
+from utils import coordinate_to_tuple
 
-def _find_sheet_xml_path(z: zipfile.ZipFile, sheet_name: str) -> str:
-    """Helper to find the XML path for a given sheet within the Excel zip archive."""
+# Cached error values that are written out as 0 in the preprocessed workbook
+_EXCEL_ERROR_STRINGS = {"#DIV/0!", "#N/A", "#NAME?", "#NULL!", "#NUM!", "#REF!", "#VALUE!"}
+
+# Clark-notation tags for the SpreadsheetML elements read in the sheet loop
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_ROW_TAG = f"{{{_NS_MAIN}}}row"
+_CELL_TAG = f"{{{_NS_MAIN}}}c"
+_VALUE_TAG = f"{{{_NS_MAIN}}}v"
+_INLINE_STRING_TAG = f"{{{_NS_MAIN}}}is"
+_TEXT_TAG = f"{{{_NS_MAIN}}}t"
+_SHARED_STRING_TAG = f"{{{_NS_MAIN}}}si"
+_PHONETIC_RUN_TAG = f"{{{_NS_MAIN}}}rPh"
+
+# Column letters -> column number for every valid column (A..XFD), built once so the lookup table
+# stays bounded no matter which references an uploaded sheet contains
+_MAX_COLUMN = 16384
+_COLUMN_NUMBERS: Dict[str, int] = {get_column_letter(col): col for col in range(1, _MAX_COLUMN + 1)}
+
+def _column_from_ref(cell_ref: str) -> int:
+    """Returns the column number of an A1-style cell reference (e.g. 'AB12' -> 28)."""
+    letters = cell_ref.rstrip("0123456789")
+    if len(letters) == len(cell_ref):
+        raise ValueError(f"Invalid cell reference: {cell_ref}")
+    col_num = _COLUMN_NUMBERS.get(letters)
+    if col_num is None:
+        # Excel writes upper-case references; tolerate lower case but never grow the table
+        col_num = _COLUMN_NUMBERS.get(letters.upper()) if letters.isascii() else None
+        if col_num is None:
+            raise ValueError(f"Invalid cell reference: {cell_ref}")
+    return col_num
+
+def read_sheet_xml_paths(z: zipfile.ZipFile) -> Dict[str, str]:
+    """Maps every sheet name in the workbook to the XML path of its worksheet within the Excel zip archive."""
     ns_wb = {"ns": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
-    wb_xml = ET.fromstring(z.read("xl/workbook.xml"))
-    sh = wb_xml.find(f".//ns:sheet[@name='{sheet_name}']", ns_wb)
-    if sh is None:
-        raise KeyError(f"Sheet '{sheet_name}' not found in workbook.xml.")
-    rid = sh.attrib["{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"]
+    with z.open("xl/workbook.xml") as fh:
+        wb_xml = ET.parse(fh).getroot()
 
     ns_rel = {"pr": "http://schemas.openxmlformats.org/package/2006/relationships"}
-    rels = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
-    entry = rels.find(f".//pr:Relationship[@Id='{rid}']", ns_rel)
-    if entry is None:
-        raise KeyError(f"Relationship {rid} not in workbook.xml.rels.")
-    target = entry.attrib["Target"]
-    if not target.startswith("xl/"):
-        target = "xl/" + target
-    return target
-
-def _get_hidden_rows_from_xml(file_path: str, sheet_name: str) -> Set[int]:
-    """Extracts hidden row numbers for a specific sheet by parsing its XML."""
-    with zipfile.ZipFile(file_path) as z:
-        try:
-            xml_path = _find_sheet_xml_path(z, sheet_name)
-            tree = ET.fromstring(z.read(xml_path))
-            ns = {"ns": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
-            hidden_rows = {
-                int(r.attrib["r"])
-                for r in tree.findall(".//ns:row", ns)
-                if r.get("hidden") == "1"
-            }
-            return hidden_rows
-        except KeyError as e:
-            logging.warning(f"Could not find XML path for sheet '{sheet_name}' or related entry: {e}")
-            return set()
-        except Exception as e:
-            logging.error(f"Error getting hidden rows for sheet '{sheet_name}': {e}", exc_info=True)
-            return set()
+    with z.open("xl/_rels/workbook.xml.rels") as fh:
+        rels = ET.parse(fh).getroot()
+    targets = {entry.attrib["Id"]: entry.attrib["Target"] for entry in rels.findall(".//pr:Relationship", ns_rel)}
+
+    sheet_xml_paths: Dict[str, str] = {}
+    for sh in wb_xml.findall(".//ns:sheet", ns_wb):
+        rid = sh.attrib["{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"]
+        target = targets.get(rid)
+        if target is None:
+            logging.warning(f"Relationship {rid} for sheet '{sh.attrib['name']}' not in workbook.xml.rels.")
+            continue
+        target = target.lstrip("/")
+        if not target.startswith("xl/"):
+            target = "xl/" + target
+        sheet_xml_paths[sh.attrib["name"]] = target
+    return sheet_xml_paths
+
+class _SharedStringsTarget:
+    """
+    lxml parser target that collects the text of each <si> in sharedStrings.xml.
+    Handles plain (<t>) and rich text (<r><t>) strings and skips phonetic runs (<rPh>),
+    without building any elements.
+    """
+    def __init__(self):
+        self.strings: List[str] = []
+        self._parts: List[str] = []
+        self._in_text = False
+        self._in_phonetic = False
+
+    def start(self, tag, attrib):
+        if tag == _TEXT_TAG:
+            self._in_text = not self._in_phonetic
+        elif tag == _SHARED_STRING_TAG:
+            self._parts = []
+        elif tag == _PHONETIC_RUN_TAG:
+            self._in_phonetic = True
+
+    def end(self, tag):
+        if tag == _TEXT_TAG:
+            self._in_text = False
+        elif tag == _SHARED_STRING_TAG:
+            self.strings.append("".join(self._parts))
+        elif tag == _PHONETIC_RUN_TAG:
+            self._in_phonetic = False
+
+    def data(self, text):
+        if self._in_text:
+            self._parts.append(text)
+
+    def close(self) -> List[str]:
+        return self.strings
 
 def _get_shared_strings(z: zipfile.ZipFile) -> List[str]:
-    """Extracts shared strings from the Excel file's sharedStrings.xml."""
+    """Extracts shared strings from the Excel file's sharedStrings.xml with an event-driven parse."""
     try:
-        shared_strings_xml = z.read("xl/sharedStrings.xml")
-        root = ET.fromstring(shared_strings_xml)
-        ns = {"ns": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
-        strings = []
-        for sst_item in root.findall(".//ns:si", ns):
-            t_element = sst_item.find("ns:t", ns)
-            if t_element is not None:
-                strings.append(t_element.text if t_element.text is not None else "")
-            else:
-                full_text = []
-                for r_element in sst_item.findall("ns:r", ns):
-                    r_t_element = r_element.find("ns:t", ns)
-                    if r_t_element is not None:
-                        full_text.append(r_t_element.text if r_t_element.text is not None else "")
-                strings.append("".join(full_text))
-        return strings
+        parser = ET.XMLParser(target=_SharedStringsTarget(), huge_tree=True)
+        with z.open("xl/sharedStrings.xml") as fh:
+            # With a parser target, parse() returns whatever the target's close() returns
+            return ET.parse(fh, parser)
     except KeyError:
         logging.warning("sharedStrings.xml not found in the Excel file. No shared strings to load.")
         return []
@@ -72,116 +112,204 @@ def _get_shared_strings(z: zipfile.ZipFile) -> List[str]:
         logging.error(f"Error loading shared strings: {e}", exc_info=True)
         return []
 
-def _extract_cell_values_from_xml(z: zipfile.ZipFile, shared_strings: List[str], sheet_name: str) -> Dict[Tuple[int, int], Any]:
-    """Extracts cell values for a specific sheet by parsing its XML."""
-    cell_values_map: Dict[Tuple[int, int], Any] = {}
+def _read_row_cells(
+    row_elem, row_num: int, shared_strings: List[str], sheet_name: str,
+    cell_values_map: Dict[Tuple[int, int], Any], wanted_cols: Optional[Set[int]] = None
+):
+    """
+    Decodes the cells of a single <row> element into cell_values_map.
+    If wanted_cols is given, cells in other columns are skipped.
+    """
+    num_shared_strings = len(shared_strings)
 
-    excel_error_strings = {"#DIV/0!", "#N/A", "#NAME?", "#NULL!", "#NUM!", "#REF!", "#VALUE!"}
-    try:
-        xml_path = _find_sheet_xml_path(z, sheet_name)
-        tree = ET.fromstring(z.read(xml_path))
-        ns = {"ns": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+    for cell_elem in row_elem.iterchildren(_CELL_TAG):
+        cell_ref = cell_elem.get("r")
+        if not cell_ref:
+            continue
+        try:
+            col_num = _column_from_ref(cell_ref)
+        except ValueError:
+            logging.warning(f"Invalid cell reference '{cell_ref}' in sheet '{sheet_name}'. Skipping cell.")
+            continue
+        if wanted_cols is not None and col_num not in wanted_cols:
+            continue # Outside the table regions; no need to decode the value
 
-        for row_elem in tree.findall(".//ns:row", ns):
-            row_num_str = row_elem.attrib.get("r")
-            if not row_num_str:
-                continue
+        value_elem = cell_elem.find(_VALUE_TAG)
+        if value_elem is None:
+            continue
+        text = value_elem.text
+        if text is None:
+            continue
+
+        cell_type = cell_elem.get("t", "n")
+        value = None
+        if text in _EXCEL_ERROR_STRINGS:
+            value = 0
+        elif cell_type == "n":
             try:
-                row_num = int(row_num_str)
+                value = float(text)
             except ValueError:
-                logging.warning(f"Invalid row number '{row_num_str}' in sheet '{sheet_name}'. Skipping row.")
-                continue
+                value = text
+        elif cell_type == "s":
+            try:
+                s_idx = int(text)
+                if 0 <= s_idx < num_shared_strings:
+                    value = shared_strings[s_idx]
+                else:
+                    logging.warning(f"Shared string index {s_idx} out of bounds for cell {cell_ref} in sheet {sheet_name}.")
+            except ValueError:
+                logging.warning(f"Invalid shared string index '{text}' for cell {cell_ref}.")
+        elif cell_type == "b":
+            value = bool(int(text))
+        elif cell_type == "inlineStr":
+            is_elem = cell_elem.find(_INLINE_STRING_TAG)
+            if is_elem is not None:
+                t_elem = is_elem.find(_TEXT_TAG)
+                if t_elem is not None:
+                    value = t_elem.text
+        else: # "str", "e" and any other type keep the raw text
+            value = text
 
-            for cell_elem in row_elem.findall(".//ns:c", ns):
-                cell_ref = cell_elem.attrib.get("r")
-                if not cell_ref:
-                    continue
+        if value is not None:
+            cell_values_map[(row_num, col_num)] = value
+
+def _extract_sheet_from_xml(
+    z: zipfile.ZipFile, shared_strings: List[str], xml_path: str, sheet_name: str,
+    wanted_cells: Optional[Set[Tuple[int, int]]] = None
+) -> Tuple[Set[int], Dict[Tuple[int, int], Any]]:
+    """
+    Extracts the hidden row numbers and cell values of a specific sheet in one streaming pass over its XML.
+    If wanted_cells is given, only those (row, column) cells are decoded and
+    parsing stops after the last row that contains one of them.
+    """
+    hidden_rows: Set[int] = set()
+    cell_values_map: Dict[Tuple[int, int], Any] = {}
+
+    # Index the wanted cells by row so unrelated rows are skipped without touching their cells
+    wanted_cols_by_row: Optional[Dict[int, Set[int]]] = None
+    last_wanted_row = 0
+    if wanted_cells is not None:
+        wanted_cols_by_row = {}
+        for r, c in wanted_cells:
+            wanted_cols_by_row.setdefault(r, set()).add(c)
+        last_wanted_row = max(wanted_cols_by_row, default=0)
+
+    try:
+        # Stream the sheet XML row by row instead of materialising the whole DOM
+        with z.open(xml_path) as fh:
+            for _, row_elem in ET.iterparse(fh, events=("end",), tag=_ROW_TAG, huge_tree=True):
+                row_num_str = row_elem.get("r")
                 try:
-                    _, col_num = coordinate_to_tuple(cell_ref)
-                except ValueError:
-                    logging.warning(f"Invalid cell reference '{cell_ref}' in sheet '{sheet_name}'. Skipping cell.")
+                    row_num = int(row_num_str)
+                except (TypeError, ValueError):
+                    if row_num_str:
+                        logging.warning(f"Invalid row number '{row_num_str}' in sheet '{sheet_name}'. Skipping row.")
                     continue
 
-                cell_type = cell_elem.attrib.get("t", "n")
-                value_elem = cell_elem.find("ns:v", ns)
-                value = None
-                
-                if value_elem is not None and value_elem.text is not None:
-                    if value_elem.text in excel_error_strings:
-                        value = 0
-                    elif cell_type == "s":
-                        try:
-                            s_idx = int(value_elem.text)
-                            if 0 <= s_idx < len(shared_strings):
-                                value = shared_strings[s_idx]
-                            else:
-                                logging.warning(f"Shared string index {s_idx} out of bounds for cell {cell_ref} in sheet {sheet_name}.")
-                        except ValueError:
-                            logging.warning(f"Invalid shared string index '{value_elem.text}' for cell {cell_ref}.")
-                    elif cell_type == "b":
-                        value = bool(int(value_elem.text))
-                    elif cell_type == "n":
-                        try:
-                            value = float(value_elem.text)
-                        except ValueError:
-                            value = value_elem.text
-                    elif cell_type == "str":
-                        value = value_elem.text
-                    elif cell_type == "inlineStr":
-                        is_elem = cell_elem.find("ns:is", ns)
-                        if is_elem is not None:
-                            t_elem = is_elem.find("ns:t", ns)
-                            if t_elem is not None:
-                                value = t_elem.text
-                    else:
-                        value = value_elem.text
-
-                if value is not None:
-                    cell_values_map[(row_num, col_num)] = value
-
-        return cell_values_map
+                if row_elem.get("hidden") == "1":
+                    hidden_rows.add(row_num)
+
+                if wanted_cols_by_row is None:
+                    _read_row_cells(row_elem, row_num, shared_strings, sheet_name, cell_values_map)
+                else:
+                    wanted_cols = wanted_cols_by_row.get(row_num)
+                    if wanted_cols:
+                        _read_row_cells(row_elem, row_num, shared_strings, sheet_name, cell_values_map, wanted_cols)
+                    if row_num >= last_wanted_row:
+                        break
+
+                # Drop rows that have already been read
+                row_elem.clear(keep_tail=True)
+                while row_elem.getprevious() is not None:
+                    del row_elem.getparent()[0]
+
+        return hidden_rows, cell_values_map
     except KeyError as e:
-        logging.error(f"Could not find XML path for sheet '{sheet_name}' or related entry: {e}")
-        return {}
+        logging.error(f"Could not find XML part '{xml_path}' for sheet '{sheet_name}': {e}")
+        return set(), {}
     except Exception as e:
         logging.error(f"Error extracting cell values for sheet '{sheet_name}': {e}", exc_info=True)
-        return {}
+        return set(), {}
+
+def region_bounds(regions: List[Tuple[str, str]]) -> List[Tuple[int, int, int, int]]:
+    """Decodes (start_cell, end_cell) regions such as ("C3", "E13") into (row_start, col_start, row_end, col_end) tuples."""
+    return [coordinate_to_tuple(start) + coordinate_to_tuple(end) for start, end in regions]
+
+def expand_region_cells(bounds: List[Tuple[int, int, int, int]]) -> Set[Tuple[int, int]]:
+    """Expands (row_start, col_start, row_end, col_end) regions, as built by region_bounds, into the set of (row, column) cells they cover."""
+    return {(r, c) for r1, c1, r2, c2 in bounds for r in range(r1, r2 + 1) for c in range(c1, c2 + 1)}
 
-def preprocess_excel_xml(source_file: str, target_file: str):
+def _read_sheet_for_preprocessing(
+    source_file: str,
+    shared_strings: List[str],
+    xml_path: str,
+    sheet_name: str,
+    wanted_cells: Optional[Set[Tuple[int, int]]] = None
+) -> Tuple[Set[int], Dict[Tuple[int, int], Any]]:
     """
-    Copies specific sheets from a source Excel file to a target Excel file using XML parsing.
-    Dynamically determines the required sheets based on fiscal calendar and naming patterns,
-    and preserves hidden row settings.
+    Reads the hidden rows and cell values of one sheet.
+    Opens its own ZipFile so sheets can be read from worker threads; ZipFile reads are not thread-safe.
     """
-    logging.info(f"Starting Excel preprocessing: Source file = {source_file}, Target file = {target_file}")
-
-    current_date = datetime.now()
-    fiscal_year, fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str = get_fiscal_quarter_and_month(current_date.date())
-    logging.info(f"Current fiscal period for preprocessing: {fiscal_quarter_str} {fiscal_month_overall_str} (Month in Q: {fiscal_month_in_quarter_str})")
+    with zipfile.ZipFile(source_file, 'r') as z:
+        return _extract_sheet_from_xml(z, shared_strings, xml_path, sheet_name, wanted_cells)
 
+def read_sheet_names(source_file: str) -> List[str]:
+    """Returns the sheet names of an Excel file, in workbook order, without loading any sheet."""
     with zipfile.ZipFile(source_file, 'r') as z:
-        ns_wb = {"ns": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
-        wb_xml = ET.fromstring(z.read("xl/workbook.xml"))
-        sheet_elements = wb_xml.findall(".//ns:sheet", ns_wb)
-        all_sheet_names = [sheet.attrib["name"] for sheet in sheet_elements]
+        return list(read_sheet_xml_paths(z))
 
-        required_sheets = find_dynamic_sheets(all_sheet_names, fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str)
-        logging.info(f"Sheets identified for preprocessing: {required_sheets}")
+def preprocess_excel_xml(
+    source_file: str,
+    target_file: Union[str, BinaryIO],
+    required_sheets: List[str],
+    wanted_cells_by_base: Optional[Dict[str, Set[Tuple[int, int]]]] = None
+) -> bool:
+    """
+    Copies required_sheets from a source Excel file to a target Excel file using XML parsing,
+    preserving hidden row settings. The caller resolves required_sheets (see find_dynamic_sheets)
+    from the fiscal period it already computed.
+    If wanted_cells_by_base ((row, col) cells keyed by base sheet name, e.g. "Exec View",
+    as built by expand_region_cells) is given, only those cells are copied for the matching sheets.
+    target_file may also be a writable binary buffer (e.g. io.BytesIO) so callers
+    that read the result straight back can skip the disk round-trip.
+    Errors are logged rather than raised; returns False if any sheet failed to copy or the
+    target could not be saved, so callers know not to reuse the result.
+    """
+    logging.info(f"Starting Excel preprocessing: Source file = {source_file}, Target file = {target_file}")
+    logging.info(f"Sheets to preprocess: {required_sheets}")
 
-        if len(required_sheets) < 4:
-            logging.warning("Not all expected sheets were found for preprocessing. Some may be missing.")
+    with zipfile.ZipFile(source_file, 'r') as z:
+        # Resolve every sheet's XML part once rather than re-parsing workbook.xml per sheet
+        sheet_xml_paths = read_sheet_xml_paths(z)
 
-        tgt_wb = Workbook()
-        if "Sheet" in tgt_wb.sheetnames:
-            del tgt_wb["Sheet"] # Remove default sheet
+        tgt_wb = Workbook(write_only=True) # Streams rows to disk instead of building a cell graph
 
         shared_strings = _get_shared_strings(z)
 
+    # Parse the sheets concurrently (lxml releases the GIL while parsing), then write
+    # them into the target workbook one by one on this thread in the original order
+    sheet_reads = {}
+    succeeded = True
+    with ThreadPoolExecutor(max_workers=4) as executor:
         for sheet_name in required_sheets:
             logging.info(f"Processing sheet for preprocessing: {sheet_name}")
+            xml_path = sheet_xml_paths.get(sheet_name)
+            if xml_path is None:
+                logging.warning(f"Sheet '{sheet_name}' not found in source workbook during preprocessing. Skipping.")
+                continue
+            wanted_cells = None
+            if wanted_cells_by_base:
+                base_sheet_name = next((k for k in wanted_cells_by_base if k in sheet_name), None)
+                if base_sheet_name:
+                    wanted_cells = wanted_cells_by_base[base_sheet_name]
+            sheet_reads[sheet_name] = (
+                wanted_cells,
+                executor.submit(_read_sheet_for_preprocessing, source_file, shared_strings, xml_path, sheet_name, wanted_cells),
+            )
+
+        for sheet_name, (wanted_cells, sheet_read) in sheet_reads.items():
             try:
-                hidden_rows = _get_hidden_rows_from_xml(source_file, sheet_name)
-                cell_values_map = _extract_cell_values_from_xml(z, shared_strings, sheet_name)
+                hidden_rows, cell_values_map = sheet_read.result()
 
                 if not cell_values_map and not hidden_rows:
                     logging.warning(f"Sheet '{sheet_name}' appears empty or could not be processed during preprocessing. Skipping.")
@@ -190,20 +318,41 @@ def preprocess_excel_xml(source_file: str, target_file: str):
                 tgt_sheet = tgt_wb.create_sheet(title=sheet_name)
                 logging.info(f"Sheet '{sheet_name}' created in target workbook for preprocessing.")
 
-                max_row, max_col = 0, 0
+                # Group cells by row so each row can be appended in a single call
+                cells_by_row: Dict[int, Dict[int, Any]] = {}
                 for (row_num, col_num), cell_value in cell_values_map.items():
-                    tgt_sheet.cell(row=row_num, column=col_num, value=cell_value)
-                    max_row, max_col = max(max_row, row_num), max(max_col, col_num)
+                    cells_by_row.setdefault(row_num, {})[col_num] = cell_value
+                max_row = max(cells_by_row, default=0)
+                if wanted_cells:
+                    # Keep hidden settings for empty trailing rows that still fall inside a region
+                    max_row = max(max_row, max(r for r, _ in wanted_cells))
 
+                # Write-only sheets emit row attributes as rows are appended, so hidden
+                # settings must be in place before any row is written
                 for row_idx in hidden_rows:
                     if row_idx <= max_row:
                         tgt_sheet.row_dimensions[row_idx].hidden = True
                 logging.info(f"Applied hidden row settings for sheet: {sheet_name}")
 
+                for row_num in range(1, max_row + 1):
+                    row_cells = cells_by_row.get(row_num)
+                    if not row_cells:
+                        tgt_sheet.append([])
+                        continue
+                    row_values = [None] * max(row_cells)
+                    for col_num, cell_value in row_cells.items():
+                        row_values[col_num - 1] = cell_value
+                    tgt_sheet.append(row_values)
+
             except Exception as e:
                 logging.error(f"Error processing sheet '{sheet_name}' during preprocessing: {e}", exc_info=True)
-        try:
-            tgt_wb.save(target_file)
-            logging.info(f"Preprocessed Excel saved to {target_file}")
-        except Exception as e:
-            logging.critical(f"Error saving target workbook '{target_file}': {e}", exc_info=True)
\ No newline at end of file
+                succeeded = False
+
+    try:
+        tgt_wb.save(target_file)
+        logging.info(f"Preprocessed Excel saved to {target_file}")
+    except Exception as e:
+        logging.critical(f"Error saving target workbook '{target_file}': {e}", exc_info=True)
+        succeeded = False
+
+    return succeeded
\ No newline at end of file
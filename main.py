@@ -5,8 +5,8 @@ from datetime import datetime
 from openpyxl import load_workbook
 
 import config
-from utils import get_dynamic_filename_components, get_fiscal_quarter_and_month, find_dynamic_sheets
-from excel_processor import preprocess_excel_xml
+from utils import get_dynamic_filename_components, get_fiscal_quarter_and_month, find_dynamic_sheets, map_sheets_to_bases
+from excel_processor import expand_region_cells, preprocess_excel_xml, read_sheet_names, region_bounds
 from ppt_updater import load_tables_from_excel, update_ppt_labels
 
 def main():
@@ -41,8 +41,46 @@ def main():
    
     logging.info(f"Dynamically determined source_excel: '{source_excel}'.")
    
+    # Define the base template for table regions
+    base_regions = {
+        "Exec View": [
+            ("C3", "E13"), ("F3", "F13"),
+            ("C18", "E24"), ("F18", "F24"), ("H18", "H18"), ("H20", "H22"),
+            ("C29", "E36"), ("F29", "F36"), ("H29", "H29"), ("H31", "H33"),
+            ("K3", "K3"), ("K4", "N13"), ("O3", "O3"), ("R4", "R13"),
+            ("S3", "S3"), ("V4", "V13"), ("W3", "W3"), ("W4", "W13"),
+        ],
+        "Comparisons": [
+            ("K3", "K3"), ("K4", "N13"), ("S3", "S13"), ("T3", "T3"),
+            ("W4", "W13"), ("X3", "X13"), ("AC3", "AC13"), ("AD3", "AD3"),
+            ("AG4", "AG13"), ("AH3", "AH13"), ("AM3", "AM13"), ("AN3", "AN3"), ("AQ4", "AQ13"),
+            ("AR3", "AR13"),
+        ],
+        "Commit": [
+            ("C3", "C3"), ("C4", "F13"), ("G3", "G3"), ("J4", "J13"),
+            ("K3", "K3"), ("N4", "N13"), ("O3", "O3"), ("R4", "R13"),
+            ("S3", "S3"), ("V4", "V13"),
+        ],
+        "Margins Scenarios": [
+            ("B15", "B15"), ("B16", "G19"), ("B20", "G20"), ("B25", "B25"),
+            ("B26", "G29"), ("B30", "G30"), ("B32", "B32"), ("B33", "G36"),
+            ("B37", "G37"), ("B39", "B39"), ("B40", "G43"), ("B44", "G44"),
+            ("B46", "B46"), ("B47", "G50"), ("B51", "G51"), ("I39", "I39"), 
+            ("I40", "N43"), ("I44", "N44"),
+        ],
+    }
+
+    current_date = datetime.now()
+    fiscal_year, fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str = get_fiscal_quarter_and_month(current_date.date())
+    logging.info(f"Current fiscal period: {fiscal_quarter_str} {fiscal_month_overall_str} (Month in Q: {fiscal_month_in_quarter_str})")
+
+    # Dynamically determine the required sheet names once; they drive both preprocessing and the PPT update
+    required_sheets = find_dynamic_sheets(read_sheet_names(source_excel), fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str)
+    logging.info(f"Sheets identified for processing: {required_sheets}")
+
     # --- Step 1: Preprocess the Excel file to create the cleaned/preprocessed Excel ---
-    preprocess_excel_xml(source_excel, config.TARGET_EXCEL_FILENAME)
+    wanted_cells_by_base = {base: expand_region_cells(region_bounds(regions)) for base, regions in base_regions.items()}
+    preprocess_excel_xml(source_excel, config.TARGET_EXCEL_FILENAME, required_sheets, wanted_cells_by_base)
 
     # --- Step 2: Load the preprocessed Excel file and prepare for PowerPoint update ---
     # Load workbook with data_only=True to get cell values (not formulas)
@@ -51,10 +89,6 @@ def main():
     sheet_names = wb_data_only.sheetnames
     logging.info(f"Sheets in preprocessed Excel: {sheet_names}")
 
-    current_date = datetime.now()
-    fiscal_year, fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str = get_fiscal_quarter_and_month(current_date.date())
-    logging.info(f"Current fiscal period for PPT update: {fiscal_quarter_str} {fiscal_month_overall_str} (Month in Q: {fiscal_month_in_quarter_str})")
-
     # --- Dynamic PowerPoint filename generation ---
     # Example: M3 Q4FY25 P&L Review_Cisco Highly Confidential _WD-1 DRAFT
     fiscal_year_short = str(fiscal_year)[2:] # Get last two digits of the fiscal year (e.g., '25' from '2025')
@@ -67,72 +101,27 @@ def main():
     dynamic_final_output_ppt_filename = config.OUTPUT_DIRECTORY / new_ppt_filename
     logging.info(f"Dynamic final PowerPoint output filename set to: '{dynamic_final_output_ppt_filename}'.")
 
-    # Dynamically determine the required sheet names for PPT update
-    identified_sheets = find_dynamic_sheets(sheet_names, fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str)
+    # Preprocessing skips empty sheets, so only keep the required sheets that made it into the workbook
+    identified_sheets = [s for s in required_sheets if s in sheet_names]
     logging.info(f"Sheets identified for PPT update: {identified_sheets}")
 
     # Define the desired order of sheets for table processing
     desired_order = ["Exec View", "Comparisons", "Commit", "Margins Scenarios"]
-    ordered_sheets = []
-
-    # Map dynamically identified sheets to their corresponding positions in the desired order
-    for desired_name in desired_order:
-        matched_sheet = None
-        for sheet in identified_sheets:
-            if desired_name in sheet:
-                matched_sheet = sheet
-                break
-        if matched_sheet:
-            ordered_sheets.append(matched_sheet)
-        else:
-            logging.warning(f"Sheet matching '{desired_name}' not found for PPT update. It will be skipped.")
+
+    # Map dynamically identified sheets to their base names, in the desired order
+    base_to_sheet = map_sheets_to_bases(identified_sheets, desired_order)
+    missing_sheets = [desired_name for desired_name in desired_order if desired_name not in base_to_sheet]
+    for desired_name in missing_sheets:
+        logging.warning(f"Sheet matching '{desired_name}' not found for PPT update. It will be skipped.")
+    ordered_sheets = list(base_to_sheet.values())
 
     logging.info(f"Ordered sheets for PPT update: {ordered_sheets}")
 
-    if len(ordered_sheets) < 4:
-        missing_sheets = set(desired_order) - set(s.split(' ', 1)[-1] for s in ordered_sheets) # Adjust to compare just the 'Exec View' part
+    if missing_sheets:
         logging.critical(f"Missing critical sheets for PPT update: {', '.join(missing_sheets)}. Ensure the source file is correct and named as expected.")
 
-    # Define the base template for table regions
-    base_regions = {
-        "Exec View": [
-            ("C3", "E13"), ("F3", "F13"),
-            ("C18", "E24"), ("F18", "F24"), ("H18", "H18"), ("H20", "H22"),
-            ("C29", "E36"), ("F29", "F36"), ("H29", "H29"), ("H31", "H33"),
-            ("K3", "K3"), ("K4", "N13"), ("O3", "O3"), ("R4", "R13"),
-            ("S3", "S3"), ("V4", "V13"), ("W3", "W3"), ("W4", "W13"),
-        ],
-        "Comparisons": [
-            ("K3", "K3"), ("K4", "N13"), ("S3", "S13"), ("T3", "T3"),
-            ("W4", "W13"), ("X3", "X13"), ("AC3", "AC13"), ("AD3", "AD3"),
-            ("AG4", "AG13"), ("AH3", "AH13"), ("AM3", "AM13"), ("AN3", "AN3"), ("AQ4", "AQ13"),
-            ("AR3", "AR13"),
-        ],
-        "Commit": [
-            ("C3", "C3"), ("C4", "F13"), ("G3", "G3"), ("J4", "J13"),
-            ("K3", "K3"), ("N4", "N13"), ("O3", "O3"), ("R4", "R13"),
-            ("S3", "S3"), ("V4", "V13"),
-        ],
-        "Margins Scenarios": [
-            ("B15", "B15"), ("B16", "G19"), ("B20", "G20"), ("B25", "B25"),
-            ("B26", "G29"), ("B30", "G30"), ("B32", "B32"), ("B33", "G36"),
-            ("B37", "G37"), ("B39", "B39"), ("B40", "G43"), ("B44", "G44"),
-            ("B46", "B46"), ("B47", "G50"), ("B51", "G51"), ("I39", "I39"), 
-            ("I40", "N43"), ("I44", "N44"),
-        ],
-    }
-
     # Dynamically map sheet names to their corresponding regions
-    table_regions = {}
-    for sheet_name in ordered_sheets:
-        if "Exec View" in sheet_name:
-            table_regions[sheet_name] = base_regions["Exec View"]
-        elif "Comparisons" in sheet_name:
-            table_regions[sheet_name] = base_regions["Comparisons"]
-        elif "Commit" in sheet_name:
-            table_regions[sheet_name] = base_regions["Commit"]
-        elif "Margins Scenarios" in sheet_name:
-            table_regions[sheet_name] = base_regions["Margins Scenarios"]
+    table_regions = {sheet_name: base_regions[desired_name] for desired_name, sheet_name in base_to_sheet.items()}
 
     logging.info("Loading tables from preprocessed Excel for PowerPoint update...")
     tables = load_tables_from_excel(str(config.TARGET_EXCEL_FILENAME), table_regions.keys(), table_regions, wb_data_only)
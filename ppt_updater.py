@@ -1,83 +1,137 @@
 import zipfile
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 import logging
 import re
+import numpy as np
 import pandas as pd
+from functools import lru_cache
 from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
 from pptx import Presentation
 from pptx.util import Inches # Important for unit conversion
 from pptx.dml.color import RGBColor
 from pptx.enum.dml import MSO_THEME_COLOR, MSO_FILL
 from datetime import datetime
-from typing import Dict, List, Tuple, Set, Any
+from typing import Callable, Dict, List, Optional, Tuple, Set, Any, Union, BinaryIO
 
+from excel_processor import read_sheet_xml_paths
 from utils import coordinate_to_tuple, find_dynamic_sheets, get_fiscal_quarter_and_month, iterate_all_shapes
 
 # Module-level dictionary to store metadata about percentage bar shapes
 _percentage_shapes_metadata: Dict[str, Dict[str, Dict[str, Any]]] = {}
 
-def _find_sheet_xml_path_for_hidden(z: zipfile.ZipFile, sheet_name: str) -> str:
-    """Helper to find the XML path for a given sheet within the Excel zip archive (used for hidden rows/cols)."""
-    ns_wb  = {"ns":"http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
-    wb_xml = ET.fromstring(z.read("xl/workbook.xml"))
-    sh     = wb_xml.find(f".//ns:sheet[@name='{sheet_name}']", ns_wb)
-    if sh is None:
-        raise KeyError(f"Sheet '{sheet_name}' not found")
-    rid = sh.attrib["{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"]
-
-    ns_rel = {"pr":"http://schemas.openxmlformats.org/package/2006/relationships"}
-    rels   = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
-    entry  = rels.find(f".//pr:Relationship[@Id='{rid}']", ns_rel)
-    if entry is None:
-        raise KeyError(f"Relationship {rid} not in workbook.xml.rels")
-    target = entry.attrib["Target"].lstrip("/")
-    return target
-
-def _get_hidden_rows_cols_from_xml(file_path: str, sheet_name: str) -> Tuple[Set[int], Set[int]]:
-    """Extracts hidden row and column numbers for a specific sheet by parsing its XML."""
-    with zipfile.ZipFile(file_path) as z:
-        xml_path = _find_sheet_xml_path_for_hidden(z, sheet_name)
-        tree     = ET.fromstring(z.read(xml_path))
-        ns       = {"ns":"http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
-
-        hidden_rows = {
-            int(r.attrib["r"])
-            for r in tree.findall(".//ns:row", ns)
-            if r.get("hidden") == "1"
-        }
-        hidden_cols = set()
-        for col in tree.findall(".//ns:cols/ns:col", ns):
-            if col.get("hidden") == "1":
-                mn, mx = int(col.get("min")), int(col.get("max"))
-                hidden_cols.update(range(mn, mx+1))
-    
+# Element-wise "is this an unevaluated formula string" check over an object array
+_is_formula_string = np.frompyfunc(lambda x: isinstance(x, str) and x.startswith("="), 1, 1)
+
+# Clark-notation tags of the worksheet elements that carry hidden flags
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_ROW_TAG = f"{{{_NS_MAIN}}}row"
+_COL_TAG = f"{{{_NS_MAIN}}}col"
+
+def _get_hidden_rows_cols_from_xml(z: zipfile.ZipFile, xml_path: str) -> Tuple[Set[int], Set[int]]:
+    """Extracts hidden row and column numbers for a sheet in one streaming pass over its XML."""
+    hidden_rows: Set[int] = set()
+    hidden_cols: Set[int] = set()
+    with z.open(xml_path) as fh:
+        for _, elem in ET.iterparse(fh, events=("end",), tag=(_ROW_TAG, _COL_TAG), huge_tree=True):
+            if elem.get("hidden") == "1":
+                if elem.tag == _ROW_TAG:
+                    hidden_rows.add(int(elem.get("r")))
+                else:
+                    hidden_cols.update(range(int(elem.get("min")), int(elem.get("max")) + 1))
+            # Drop handled elements so only one row is held in memory at a time
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
     return hidden_rows, hidden_cols
 
-def _extract_openpyxl_block(
-    workbook: Workbook, sheet_name: str, start_cell: str, end_cell: str,
-    hidden_rows: Set[int], hidden_cols: Set[int]
-) -> pd.DataFrame:
-    """Extracts a block of data from an openpyxl workbook, respecting hidden rows/columns."""
-    ws = workbook[sheet_name]
-    r1, c1 = coordinate_to_tuple(start_cell)
-    r2, c2 = coordinate_to_tuple(end_cell)
-
-    data = []
-    for r in range(r1, r2+1):
-        if r in hidden_rows:
-            continue
-        row_vals = []
-        for c in range(c1, c2+1):
-            if c in hidden_cols:
+def _load_hidden_rows_cols(file_path: Union[str, BinaryIO], sheet_names: Tuple[str, ...]) -> Dict[str, Tuple[Set[int], Set[int]]]:
+    """
+    Returns (hidden_rows, hidden_cols) for each of sheet_names, opening the zip and parsing
+    workbook.xml only once. Sheets missing from the workbook, or whose worksheet part is
+    missing from the archive, are left out.
+    """
+    hidden_by_sheet: Dict[str, Tuple[Set[int], Set[int]]] = {}
+    with zipfile.ZipFile(file_path) as z:
+        sheet_xml_paths = read_sheet_xml_paths(z)
+        for sheet in sheet_names:
+            if sheet not in sheet_xml_paths:
                 continue
-            row_vals.append(ws.cell(row=r, column=c).value)
-        data.append(row_vals)
+            try:
+                hidden_by_sheet[sheet] = _get_hidden_rows_cols_from_xml(z, sheet_xml_paths[sheet])
+            except KeyError:
+                # The relationship points at a part that is not in the archive
+                logging.warning(f"Worksheet part '{sheet_xml_paths[sheet]}' for sheet '{sheet}' not found in the workbook.")
+    return hidden_by_sheet
+
+def _offsets_in_range(sorted_indices: np.ndarray, first: int, last: int) -> np.ndarray:
+    """Returns the entries of sorted_indices within [first, last], as offsets from first."""
+    lo = np.searchsorted(sorted_indices, first, side="left")
+    hi = np.searchsorted(sorted_indices, last, side="right")
+    return sorted_indices[lo:hi] - first
+
+def _load_sheet_tables(
+    workbook: Workbook,
+    sheet: str,
+    regions: List[Tuple[str, str]],
+    hidden_rows: Set[int],
+    hidden_cols: Set[int]
+) -> List[pd.DataFrame]:
+    """Reads each of a sheet's regions into a DataFrame with hidden rows/columns removed and formula strings resolved."""
+    # Sorted once per sheet so each region can slice out its own hidden rows/cols with a binary search
+    hidden_rows_arr = np.array(sorted(hidden_rows), dtype=np.int64)
+    hidden_cols_arr = np.array(sorted(hidden_cols), dtype=np.int64)
+
+    dfs: List[pd.DataFrame] = []
+    for start, end in regions:
+        r1, c1 = coordinate_to_tuple(start)
+        r2, c2 = coordinate_to_tuple(end)
 
-    return pd.DataFrame(data)
+        try:
+            # Read the region from the already-open workbook instead of re-opening the file per region
+            rows = workbook[sheet].iter_rows(min_row=r1, max_row=r2, min_col=c1, max_col=c2, values_only=True)
+            df = pd.DataFrame(list(rows), dtype=object)
+        except Exception as e:
+            logging.error(f"Error reading range {start}:{end} in sheet '{sheet}': {e}")
+            continue
+
+        # Apply hidden row/column filtering
+        drop_r = _offsets_in_range(hidden_rows_arr, r1, r2)
+        drop_r = drop_r[drop_r < len(df)]
+        if drop_r.size:
+            df = df.drop(index=drop_r).reset_index(drop=True)
+
+        drop_c = _offsets_in_range(hidden_cols_arr, c1, c2)
+        drop_c = drop_c[drop_c < len(df.columns)]
+        if drop_c.size:
+            cols_to_drop = df.columns[drop_c]
+            df = df.drop(columns=cols_to_drop)
+
+        # Handle formula values by looking up just those cells in the openpyxl workbook
+        values = df.to_numpy(dtype=object)
+        mask = _is_formula_string(values).astype(bool)
+        if mask.any():
+            ws = workbook[sheet]
+            kept_rows = [r for r in range(r1, r2 + 1) if r not in hidden_rows]
+            kept_cols = [c for c in range(c1, c2 + 1) if c not in hidden_cols]
+            mask_rows, mask_cols = mask.nonzero()
+            values = values.copy() # to_numpy() may return a read-only view of the frame
+            values[mask_rows, mask_cols] = [ws.cell(row=kept_rows[i], column=kept_cols[j]).value for i, j in zip(mask_rows, mask_cols)]
+
+        # Blank out empty cells in the object buffer, then let pandas settle each column's dtype
+        na_mask = pd.isna(values)
+        if na_mask.any():
+            if not values.flags.writeable:
+                values = values.copy()
+            values[na_mask] = ""
+        df = pd.DataFrame(values, columns=df.columns, dtype=object).infer_objects()
+
+        dfs.append(df)
+
+    return dfs
 
 def load_tables_from_excel(
-    file_path: str,
+    file_path: Union[str, BinaryIO],
     sheet_names: List[str],
     table_regions: Dict[str, List[Tuple[str, str]]],
     workbook: Workbook # Pass the loaded workbook here
@@ -85,62 +139,21 @@ def load_tables_from_excel(
     """
     Loads specified table regions from an Excel file into pandas DataFrames,
     handling hidden rows and columns.
+    Cell values are read from the passed workbook; file_path is only used to
+    look up hidden rows and columns, which openpyxl's read-only mode does not expose.
+    It may be a path or the in-memory buffer the workbook was loaded from.
     """
     all_tables: Dict[str, List[pd.DataFrame]] = {}
 
+    sheet_names = tuple(sheet_names)
+    hidden_by_sheet = _load_hidden_rows_cols(file_path, sheet_names)
+
     for sheet in sheet_names:
-        try:
-            hidden_rows, hidden_cols = _get_hidden_rows_cols_from_xml(file_path, sheet)
-        except KeyError:
+        if sheet not in hidden_by_sheet:
             logging.warning(f"Sheet '{sheet}' not found for table loading → skipping")
             continue
-
-        dfs: List[pd.DataFrame] = []
-        for start, end in table_regions[sheet]:
-            r1, c1 = coordinate_to_tuple(start)
-            r2, c2 = coordinate_to_tuple(end)
-
-            try:
-                # Use pandas read_excel for initial data load
-                df = pd.read_excel(
-                    file_path,
-                    sheet_name=sheet,
-                    header=None,
-                    skiprows=r1 - 1,
-                    nrows=(r2 - r1 + 1),
-                    usecols=f"{get_column_letter(c1)}:{get_column_letter(c2)}",
-                    engine="openpyxl",
-                    dtype=object
-                )
-            except Exception as e:
-                logging.error(f"Error reading range {start}:{end} in sheet '{sheet}': {e}")
-                continue
-
-            # Apply hidden row/column filtering
-            drop_r = [r - r1 for r in hidden_rows if r1 <= r <= r2]
-            drop_r = [r for r in drop_r if r < len(df)]
-            if drop_r:
-                df = df.drop(index=drop_r).reset_index(drop=True)
-
-            drop_c = [c - c1 for c in hidden_cols if c1 <= c <= c2]
-            drop_c = [c for c in drop_c if c < len(df.columns)]
-            if drop_c:
-                cols_to_drop = df.columns[drop_c]
-                df = df.drop(columns=cols_to_drop)
-
-            # Handle formula values by extracting from openpyxl workbook
-            fallback = _extract_openpyxl_block(workbook, sheet, start, end, hidden_rows, hidden_cols)
-            fallback = fallback.iloc[: df.shape[0], : df.shape[1]] # Ensure dimensions match after drops
-            mask = df.map(lambda x: isinstance(x, str) and x.startswith("="))
-            for i, j in zip(*mask.to_numpy().nonzero()):
-                df.iat[i, j] = fallback.iat[i, j]
-            
-            pd.set_option('future.no_silent_downcasting', True)
-            df = df.fillna("").infer_objects(copy=False)
-
-            dfs.append(df)
-
-        all_tables[sheet] = dfs
+        hidden_rows, hidden_cols = hidden_by_sheet[sheet]
+        all_tables[sheet] = _load_sheet_tables(workbook, sheet, table_regions[sheet], hidden_rows, hidden_cols)
 
     return all_tables
 
@@ -164,31 +177,57 @@ def _get_date_labels() -> Dict[str,str]:
         "Month":         actual_month_name
     }
 
-def _replace_date_tags(prs: Presentation):
-    """Replaces date-related placeholders (e.g., {{Date}}) in the PowerPoint presentation."""
-    labels = _get_date_labels()
-
-    for slide in prs.slides:
-        for shape in iterate_all_shapes(slide.shapes):
-            if not getattr(shape, "has_text_frame", False):
-                continue
-
-            for paragraph in shape.text_frame.paragraphs:
-                full_text = "".join(run.text for run in paragraph.runs)
-                new_text = full_text
-
-                for key, val in labels.items():
-                    tag = f"{{{{{key}}}}}"
-                    if tag in new_text:
-                        new_text = new_text.replace(tag, str(val))
-
-                if new_text != full_text:
-                    for run in paragraph.runs:
-                        run.text = "" # Clear existing runs
-                    if paragraph.runs:
-                        paragraph.runs[0].text = new_text # Update first run
-                    else:
-                        paragraph.add_run().text = new_text # Add new run if none exist
+# Matches any of the {{Tag}} placeholders produced by _get_date_labels
+_DATE_TAG_RE = re.compile(r"\{\{(QuarterLabel|MonthLabel|Date|YearLabel|Title|dateLabel|Month)\}\}")
+
+def _replace_date_tags_in_paragraph(paragraph, labels: Dict[str, str]):
+    """Replaces date-related placeholders (e.g., {{Date}}) in a paragraph, which may span several runs."""
+    full_text = "".join(run.text for run in paragraph.runs)
+    if "{{" not in full_text:
+        return
+    new_text = _DATE_TAG_RE.sub(lambda m: str(labels[m.group(1)]), full_text)
+
+    if new_text != full_text:
+        for run in paragraph.runs:
+            run.text = "" # Clear existing runs
+        if paragraph.runs:
+            paragraph.runs[0].text = new_text # Update first run
+        else:
+            paragraph.add_run().text = new_text # Add new run if none exist
+
+# Placeholder prefixes grouped by how their values are displayed
+_MILLIONS_PREFIXES = frozenset({"a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", "l", "m",
+                                "n", "o", "p", "q", "r", "s", "t", "u", "v", "w", "x", "y", "z",
+                                "ab", "ac", "ad", "ae", "af", "ag", "ah"})
+_PERCENT_INT_PREFIXES = frozenset({"aa", "bb", "cc", "dd", "ee", "ff", "gg", "hh", "ii"})
+_PERCENT_DECIMAL_PREFIXES = frozenset({"AB", "BC", "CD", "DE", "EF", "FG", "HH", "II"})
+_THOUSANDS_PREFIXES = frozenset({"A", "B", "C", "D", "E", "F"})
+
+def _format_millions(value: float) -> Tuple[str, float]:
+    """Formats a value in millions with one decimal, negatives in parentheses (e.g. (1.2))."""
+    if value < 0:
+        return f"({abs(value) / 1_000_000:.1f})", 0.0
+    return f"{value / 1_000_000:.1f}", 0.0
+
+def _format_percent_int(value: float) -> Tuple[str, float]:
+    """Formats a ratio as an integer percentage (e.g. 56%); the raw ratio drives the shape width."""
+    return f"{round(value * 100):,}%", value
+
+def _format_percent_decimal(value: float) -> Tuple[str, float]:
+    """Formats a ratio as a one-decimal percentage (e.g. 56.0%); the raw ratio drives the shape width."""
+    return f"{value * 100:.1f}%", value
+
+def _format_thousands(value: float) -> Tuple[str, float]:
+    """Formats a value in whole thousands with separators."""
+    return f"{int(value) // 1_000:,}", 0.0
+
+# Prefix -> formatter lookup, so formatting a value is a single dict probe
+_VALUE_FORMATTERS: Dict[str, Callable[[float], Tuple[str, float]]] = {
+    **{prefix: _format_millions for prefix in _MILLIONS_PREFIXES},
+    **{prefix: _format_percent_int for prefix in _PERCENT_INT_PREFIXES},
+    **{prefix: _format_percent_decimal for prefix in _PERCENT_DECIMAL_PREFIXES},
+    **{prefix: _format_thousands for prefix in _THOUSANDS_PREFIXES},
+}
 
 def _format_custom_value(prefix: str, value: Any) -> Tuple[str, float]:
     """
@@ -196,91 +235,77 @@ def _format_custom_value(prefix: str, value: Any) -> Tuple[str, float]:
     Returns a tuple of (formatted_value, raw_percentage_for_shapes).
     raw_percentage_for_shapes is the value normalized to 0.0-1.0 for shape width calculation.
     """
-    raw_percentage_for_shapes = 0.0 # Default
-
     # Handle string values gracefully
     if isinstance(value, str):
-        return value, raw_percentage_for_shapes
-    
+        return value, 0.0
+
     # Handle None or NaN values
     if value is None or pd.isna(value):
-        return "", raw_percentage_for_shapes
+        return "", 0.0
 
     # Convert to float for numeric values
     value = float(value)
-    formatted_value = ""
-
-    # Handle millions formatting (a-z, ab-ah)
-    if prefix in {"a", "b", "c", "d", "e", "f", "g", "h", "i", "j", "k", "l", "m", 
-                  "n", "o", "p", "q", "r", "s", "t", "u", "v", "w", "x", "y", "z", 
-                  "ab", "ac", "ad", "ae", "af", "ag", "ah"}:
-        formatted_value = f"{value / 1_000_000:.1f}"
-        if value < 0:
-            formatted_value = f"({abs(value) / 1_000_000:.1f})"
-        return formatted_value, raw_percentage_for_shapes
-
-    # These prefixes get integer percentage formatting
-    if prefix in {"aa", "bb", "cc", "dd", "ee", "ff", "gg", "hh", "ii"}:
-        raw_percentage_for_shapes = value # Use raw value for shape calculation (e.g., 0.56)
-        formatted_value = f"{round(value * 100):,}%" # Formats to integer percentage (e.g., 56%)
-        return formatted_value, raw_percentage_for_shapes
-    
-    # These prefixes get one-decimal percentage formatting
-    if prefix in {"AB", "BC", "CD", "DE", "EF", "FG", "HH", "II"}:
-        raw_percentage_for_shapes = value # Use raw value for shape calculation (e.g., 0.56)
-        formatted_value = f"{value * 100:.1f}%" # Formats to one decimal place (e.g., 56.0%)
-        return formatted_value, raw_percentage_for_shapes
-    
-    if prefix in {"A", "B", "C", "D", "E", "F"}:
-        return f"{int(value) // 1_000:,}", raw_percentage_for_shapes
-    
-    # Default return if no specific prefix match
-    return str(value), raw_percentage_for_shapes
 
+    formatter = _VALUE_FORMATTERS.get(prefix)
+    if formatter is None:
+        # Default if no specific prefix matches
+        return str(value), 0.0
+    return formatter(value)
 
-def _collect_initial_shape_data(prs: Presentation):
+
+# Percentage bar shapes are named bar_XXYY, e.g. bar_aa3 -> prefix "aa", cell number 3
+_BAR_RE = re.compile(r"^bar_([A-Za-z]{1,2})(\d+)$")
+
+def _record_bar_shape(slide_idx: int, slide_id: int, shape) -> bool:
     """
-    Collects initial width and left position of shapes intended for percentage bars.
+    Records the initial width and left position of a shape intended for a percentage bar.
     These shapes should be named with the convention 'bar_XXYY' (e.g., 'bar_aa3').
+    Returns True if the shape was recorded.
     """
-    global _percentage_shapes_metadata
-    _percentage_shapes_metadata = {} # Clear previous data
+    # Check if shape has a name and matches the 'bar_XXYY' convention
+    # Removed: 'not getattr(shape, "has_text_frame", False)' condition
+    # This allows rectangles (which have text frames) to be identified as bar shapes.
+    if not hasattr(shape, 'name'):
+        return False
+    match = _BAR_RE.match(shape.name)
+    if not match:
+        return False
+
+    # Ensure it's not a table itself (which also has a name)
+    if shape.has_table:
+        logging.warning(f"  Shape '{shape.name}' on slide {slide_idx+1} matches naming convention but is a Table. Skipping.")
+        return False
+
+    prefix, number_str = match.groups()
+    _percentage_shapes_metadata[slide_id][shape.name] = {
+        "shape_obj": shape,
+        "original_width": shape.width,
+        "original_left": shape.left,
+        "prefix": prefix,
+        "number": number_str
+    }
+    return True
 
-    logging.info("Collecting initial shape data for percentage bars...")
-    found_shapes_count = 0
-    for slide_idx, slide in enumerate(prs.slides):
-        slide_id = slide.slide_id # Use slide_id for unique identification
-        _percentage_shapes_metadata[slide_id] = {}
-        for shape in iterate_all_shapes(slide.shapes):
-            # Check if shape has a name and matches the 'bar_XXYY' convention
-            # Removed: 'not getattr(shape, "has_text_frame", False)' condition
-            # This allows rectangles (which have text frames) to be identified as bar shapes.
-            if hasattr(shape, 'name'):
-                match = re.match(r"^bar_([A-Za-z]{1,2}\d+)$", shape.name)
-                if match:
-                    # Ensure it's not a table itself (which also has a name)
-                    if shape.has_table:
-                        logging.warning(f"  Shape '{shape.name}' on slide {slide_idx+1} matches naming convention but is a Table. Skipping.")
-                        continue
-                    
-                    xx_yy_key = match.group(1)
-                    _percentage_shapes_metadata[slide_id][shape.name] = {
-                        "shape_obj": shape,
-                        "original_width": shape.width,
-                        "original_left": shape.left,
-                        "xx_yy_key": xx_yy_key
-                    }
-                    found_shapes_count += 1
-                    
-                # Added a more specific warning for shapes that match name but are group shapes (not common for bars)
-                elif re.match(r"^bar_([A-Za-z]{1,2}\d+)$", shape.name) and shape.is_group:
-                    logging.warning(f"  Shape '{shape.name}' on slide {slide_idx+1} matches naming convention but is a GroupShape. Skipping.")
+def _replace_placeholders_in_paragraph(paragraph, placeholder_repl: Callable[[re.Match], str]):
+    """Replaces numeric {{XXYY}} placeholders run by run, so each run keeps its own formatting."""
+    for run in paragraph.runs:
+        original_text = run.text
+        updated_text = _PLACEHOLDER_RE.sub(placeholder_repl, original_text)
+        if updated_text != original_text:
+            run.text = updated_text
 
-    if found_shapes_count == 0:
-        logging.warning("No shapes matching the 'bar_XXYY' naming convention were found in the presentation.")
-    
+# A table as (nrows, ncols, column arrays), for cell lookups without pandas indexing overhead
+_TableArrays = Tuple[int, int, List[np.ndarray]]
+
+def _to_table_arrays(df: pd.DataFrame) -> _TableArrays:
+    """
+    Materializes a DataFrame as per-column NumPy arrays. Columns keep their own dtype,
+    so a lookup returns the same value df.iat would (e.g. numpy.int64 for integer columns).
+    """
+    nrows, ncols = df.shape
+    return nrows, ncols, [df.iloc[:, j].to_numpy() for j in range(ncols)]
 
-def _update_percentage_shapes(all_tbls_flat: List[pd.DataFrame], lmap: Dict[str, int]):
+def _update_percentage_shapes(all_tbls_flat: List[_TableArrays], lmap: Dict[str, int]):
     """
     Updates the width and color of identified percentage bar shapes based on Excel data.
     """
@@ -289,35 +314,28 @@ def _update_percentage_shapes(all_tbls_flat: List[pd.DataFrame], lmap: Dict[str,
     WHITE = RGBColor(255, 255, 255) # For 0% or no change
 
     
+    # Shapes at 0% are collected per slide and removed after the loop in a single pass over each shape tree
+    shapes_to_remove: Dict[object, list] = {}
     updated_shapes_count = 0
     for slide_id, shapes_on_slide in _percentage_shapes_metadata.items():
         for shape_name, shape_info in shapes_on_slide.items():
             shape_obj = shape_info["shape_obj"]
             original_width = shape_info["original_width"]
             original_left = shape_info["original_left"]
-            xx_yy_key = shape_info["xx_yy_key"]
+            # Prefix and number were split from the shape name when it was collected
+            prefix = shape_info["prefix"]
+            number_str = shape_info["number"]
 
-            
             try:
-                # Extract prefix and number from XXYY key
-                pat = re.compile(r"([A-Za-z]{1,2})(\d+)")
-                match = pat.match(xx_yy_key)
-                if not match:
-                    logging.warning(f"    Invalid XXYY key format '{xx_yy_key}' for shape {shape_name}. Skipping shape update.")
-                    continue
-
-                prefix, number_str = match.groups()
                 table_index = lmap.get(prefix)
                 cell_index = int(number_str) - 1
 
                 if table_index is not None and 0 <= table_index < len(all_tbls_flat):
-                    df = all_tbls_flat[table_index]
-                    df_ncols = df.shape[1]
-                    df_nrows = df.shape[0]
+                    df_nrows, df_ncols, df_columns = all_tbls_flat[table_index]
                     df_row, df_col = divmod(cell_index, df_ncols)
 
                     if df_row < df_nrows and df_col < df_ncols:
-                        raw_value = df.iat[df_row, df_col]
+                        raw_value = df_columns[df_col][df_row]
                         
                         
                         # Ensure raw_value is numeric for calculations
@@ -343,11 +361,11 @@ def _update_percentage_shapes(all_tbls_flat: List[pd.DataFrame], lmap: Dict[str,
                             fill.fore_color.rgb = GREEN
                             
                         elif normalized_percentage_for_width == 0.0:  # 0%
-                            # Remove the shape from the slide if percentage is 0%
-                            # `shape_obj` is the shape; we need to get its parent collection and call ._spTree.remove()
+                            # Remove the shape from the slide if percentage is 0%; queued so each slide's
+                            # shape tree is filtered once below
                             # The following is safe for python-pptx >= 0.6.17 (commonly used)
-                            slide = shape_obj.part.slide
-                            slide.shapes._spTree.remove(shape_obj._element)
+                            sp_tree = shape_obj.part.slide.shapes._spTree
+                            shapes_to_remove.setdefault(sp_tree, []).append((shape_name, shape_obj._element))
 
                         else: # Between 0% and 100% (exclusive)
                             # CRITICAL FIX: Round the calculated width to an integer
@@ -367,16 +385,55 @@ def _update_percentage_shapes(all_tbls_flat: List[pd.DataFrame], lmap: Dict[str,
                     logging.warning(f"    Table index {table_index} not found for shape {shape_name}. Skipping shape update.")
             except Exception as e:
                 logging.error(f"    Error updating shape {shape_name}: {e}", exc_info=True)
+
+    for sp_tree, queued in shapes_to_remove.items():
+        victims = {element for _, element in queued}
+        for child in list(sp_tree):
+            if child in victims:
+                sp_tree.remove(child)
+                victims.discard(child)
+        # Only top-level shapes can be removed from the slide's shape tree (e.g. not shapes inside a group)
+        for shape_name, element in queued:
+            if element in victims:
+                logging.error(f"    Error updating shape {shape_name}: shape is not a direct child of the slide's shape tree")
     
     
 
+# Pattern for {{XXYY}} placeholders, e.g. {{a12}} -> prefix "a", cell number 12
+_PLACEHOLDER_RE = re.compile(r"\{\{([A-Za-z]{1,2})(\d+)}}")
+
+def _make_placeholder_repl(all_tbls_flat: List[_TableArrays], lmap: Dict[str, int]) -> Callable[[re.Match], str]:
+    """
+    Returns a _PLACEHOLDER_RE.sub callback that swaps a {{XXYY}} placeholder for its formatted table value.
+    Placeholders that do not resolve to a table cell are left as they are.
+    Each distinct placeholder is resolved and formatted once; the cache lives as long as the callback.
+    """
+    @lru_cache(maxsize=None)
+    def resolve(prefix: str, number: str) -> Optional[str]:
+        table_index = lmap.get(prefix)
+        cell_index = int(number) - 1
+
+        if table_index is not None and 0 <= table_index < len(all_tbls_flat):
+            nrows, ncols, columns = all_tbls_flat[table_index]
+            row, col = divmod(cell_index, ncols)
+
+            if row < nrows and col < ncols:
+                formatted_value, _ = _format_custom_value(prefix, columns[col][row])
+                return formatted_value
+        return None
+
+    def repl(match: re.Match) -> str:
+        formatted_value = resolve(*match.groups())
+        return match.group(0) if formatted_value is None else formatted_value
+
+    return repl
+
 def update_ppt_labels(pptx_path: str, output_path: str, table_data: Dict[str, List[pd.DataFrame]]):
     """
     Updates a PowerPoint presentation with data from Excel tables and date labels.
     Applies dynamic sizing and coloring to shapes named 'bar_XXYY'.
     """
     prs = Presentation(pptx_path)
-    pat = re.compile(r"\{\{([A-Za-z]{1,2})(\d+)}}") # Pattern for {{XXYY}} placeholders
     
     # Custom order for mapping prefixes to tables (as per original script)
     custom_order = [
@@ -386,84 +443,53 @@ def update_ppt_labels(pptx_path: str, output_path: str, table_data: Dict[str, Li
         "ac", "ad", "ae", "af", "ag", "ah", "AA", "A", "AB", "BB", "B", "BC", "CC", "C", "CD", "DD", "D", "DE", "EE", "E", "EF", "FF", "F", "FG"
     ]
 
-    # Flatten table_data into a single list for lmap indexing
-    all_tbls_flat = []
-    lmap = {} # Maps prefix (e.g., 'a') to its index in all_tbls_flat list
-    for sheet_name in table_data:
-        tables_in_sheet = table_data.get(sheet_name, [])
-        for i, table_df in enumerate(tables_in_sheet):
-            if len(all_tbls_flat) < len(custom_order):
-                prefix = custom_order[len(all_tbls_flat)]
-                lmap[prefix] = len(all_tbls_flat)
-                all_tbls_flat.append(table_df)
-            else:
-                logging.warning(f"More tables found than prefixes in custom_order. Skipping table from sheet {sheet_name}.")
+    # Flatten table_data into a single list of column arrays for lmap indexing
+    # zip stops at the shorter side, so tables beyond the last prefix are never converted
+    tables_iter = (table_df for sheet_name in table_data for table_df in table_data[sheet_name])
+    paired = list(zip(custom_order, tables_iter))
+    lmap = {prefix: i for i, (prefix, _) in enumerate(paired)} # Maps prefix (e.g., 'a') to its index in all_tbls_flat list
+    all_tbls_flat = [_to_table_arrays(table_df) for _, table_df in paired]
+    skipped_tables = sum(1 for _ in tables_iter)
+    if skipped_tables:
+        logging.warning(f"More tables found than prefixes in custom_order. Skipping {skipped_tables} table(s).")
 
 
-    # 1) Collect initial data for percentage shapes
-    _collect_initial_shape_data(prs)
+    global _percentage_shapes_metadata
+    _percentage_shapes_metadata = {} # Clear previous data
 
-    # 2) Replace date tags first
-    _replace_date_tags(prs)
+    labels = _get_date_labels()
+    placeholder_repl = _make_placeholder_repl(all_tbls_flat, lmap)
 
-    # 3) Replace numeric placeholders in text boxes and table cells
-    for slide in prs.slides:
+    # One walk over every shape: record percentage bar shapes, then replace date tags
+    # (paragraph level) and numeric placeholders (run level) in text boxes and table cells
+    logging.info("Collecting percentage bar shapes and replacing placeholders...")
+    found_shapes_count = 0
+    for slide_idx, slide in enumerate(prs.slides):
+        slide_id = slide.slide_id # Use slide_id for unique identification
+        _percentage_shapes_metadata[slide_id] = {}
         for shp in iterate_all_shapes(slide.shapes):
-            # Process text boxes
-            if hasattr(shp, "text_frame"):
+            if _record_bar_shape(slide_idx, slide_id, shp):
+                found_shapes_count += 1
+
+            # Process text boxes; shapes without any "{{" cannot hold a tag, so skip their runs entirely
+            if getattr(shp, "has_text_frame", False) and "{{" in shp.text_frame.text:
                 for p in shp.text_frame.paragraphs:
-                    for run in p.runs:
-                        original_text = run.text
-                        updated_text = original_text
-
-                        for match in pat.findall(original_text):
-                            prefix, number = match
-                            table_index = lmap.get(prefix)
-                            cell_index = int(number) - 1
-
-                            if table_index is not None and 0 <= table_index < len(all_tbls_flat):
-                                df = all_tbls_flat[table_index]
-                                ncols = df.shape[1]
-                                nrows = df.shape[0]
-                                row, col = divmod(cell_index, ncols)
-
-                                if row < nrows and col < ncols:
-                                    value = df.iat[row, col]
-                                    formatted_value, _ = _format_custom_value(prefix, value) 
-                                    updated_text = updated_text.replace(f"{{{{{prefix}{number}}}}}", formatted_value)
-                                    
-                        if updated_text != original_text:
-                            run.text = updated_text
+                    _replace_date_tags_in_paragraph(p, labels)
+                    _replace_placeholders_in_paragraph(p, placeholder_repl)
 
             # Process table cells (only for text replacement, no background coloring here)
-            if hasattr(shp, "has_table") and shp.has_table:
-                for r_idx, row_obj in enumerate(shp.table.rows):
-                    for c_idx, cell_obj in enumerate(row_obj.cells):
+            if getattr(shp, "has_table", False):
+                for row_obj in shp.table.rows:
+                    for cell_obj in row_obj.cells:
+                        if "{{" not in cell_obj.text_frame.text:
+                            continue
                         for p in cell_obj.text_frame.paragraphs:
-                            for run in p.runs:
-                                original_text = run.text
-                                updated_text = original_text
-
-                                for match in pat.findall(original_text):
-                                    prefix, number = match
-                                    table_index = lmap.get(prefix)
-                                    df_cell_index = int(number) - 1
-
-                                    if table_index is not None and 0 <= table_index < len(all_tbls_flat):
-                                        df = all_tbls_flat[table_index]
-                                        df_ncols = df.shape[1]
-                                        df_nrows = df.shape[0]
-                                        df_row, df_col = divmod(df_cell_index, df_ncols)
-
-                                        if df_row < df_nrows and df_col < df_ncols:
-                                            value = df.iat[df_row, df_col]
-                                            formatted_value, _ = _format_custom_value(prefix, value)
-                                            updated_text = updated_text.replace(f"{{{{{prefix}{number}}}}}", formatted_value)
-                                            
-                                if updated_text != original_text:
-                                    run.text = updated_text
-                                        
-    # 4) Update percentage bar shapes
+                            _replace_placeholders_in_paragraph(p, placeholder_repl)
+
+    if found_shapes_count == 0:
+        logging.warning("No shapes matching the 'bar_XXYY' naming convention were found in the presentation.")
+
+    # Update percentage bar shapes
     _update_percentage_shapes(all_tbls_flat, lmap)
 
     prs.save(output_path)
@@ -1,21 +1,25 @@
 import re
 import logging
+from functools import lru_cache
 from datetime import datetime, date
-from typing import Tuple, List
+from typing import Tuple, List, Dict, Optional
 from dateutil.relativedelta import relativedelta
+from openpyxl.utils.cell import coordinate_to_tuple as _openpyxl_coordinate_to_tuple
 
 
 def coordinate_to_tuple(cell_ref: str) -> Tuple[int, int]:
-    """Converts an Excel cell reference (e.g., 'A1', 'B10') to a (row, column) tuple."""
-    match = re.match(r"([A-Za-z]+)(\d+)", cell_ref)
-    if not match:
+    """
+    Converts an Excel cell reference (e.g., 'A1', 'B10') to a (row, column) tuple.
+    Delegates to openpyxl's parser, which splits the reference without a regex match per call.
+    """
+    if not cell_ref:
         raise ValueError(f"Invalid cell reference: {cell_ref}")
-    col_str, row_str = match.groups()
-    col_num = 0
-    for i, char in enumerate(reversed(col_str)):
-        col_num += (ord(char.upper()) - 64) * (26 ** i)
-    return int(row_str), col_num
+    try:
+        return _openpyxl_coordinate_to_tuple(cell_ref)
+    except ValueError as e:
+        raise ValueError(f"Invalid cell reference: {cell_ref}") from e
 
+@lru_cache(maxsize=32)
 def get_fiscal_quarter_and_month(date_obj: date) -> Tuple[int, str, str, str]:
     """
     Determines the fiscal year, fiscal quarter (Q1, Q2, ...), overall fiscal month (M1, M2, ... M12),
@@ -34,11 +38,9 @@ def get_fiscal_quarter_and_month(date_obj: date) -> Tuple[int, str, str, str]:
 
     return fiscal_year, f"Q{fiscal_quarter_num}", f"M{fiscal_month_overall_num}", f"M{fiscal_month_in_quarter_num}"
 
-def find_dynamic_sheets(sheet_names: List[str], fiscal_quarter_str: str, fiscal_month_overall_str: str, fiscal_month_in_quarter_str: str) -> List[str]:
-    """
-    Dynamically finds sheet names based on the fiscal quarter, overall fiscal month,
-    month within quarter, and required patterns.
-    """
+@lru_cache(maxsize=32)
+def _match_dynamic_sheets(sheet_names: Tuple[str, ...], fiscal_quarter_str: str, fiscal_month_overall_str: str, fiscal_month_in_quarter_str: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """Returns each required pattern with the first sheet name it matches (None if none does)."""
     required_patterns = [
         r"^Margins Scenarios$",
         rf"^{fiscal_month_in_quarter_str} .*Exec View$",
@@ -46,19 +48,42 @@ def find_dynamic_sheets(sheet_names: List[str], fiscal_quarter_str: str, fiscal_
         rf"^{fiscal_quarter_str} Commit$",
     ]
 
-    matched_sheets = []
+    matches = []
     for pattern in required_patterns:
-        matched = False
-        for sheet_name in sheet_names:
-            if re.match(pattern, sheet_name, re.IGNORECASE):
-                matched_sheets.append(sheet_name)
-                matched = True
-                break
-        if not matched:
+        compiled = re.compile(pattern, re.IGNORECASE)
+        matches.append((pattern, next((sheet_name for sheet_name in sheet_names if compiled.match(sheet_name)), None)))
+    return tuple(matches)
+
+def find_dynamic_sheets(sheet_names: List[str], fiscal_quarter_str: str, fiscal_month_overall_str: str, fiscal_month_in_quarter_str: str) -> List[str]:
+    """
+    Dynamically finds sheet names based on the fiscal quarter, overall fiscal month,
+    month within quarter, and required patterns.
+    Results are cached per sheet list and fiscal period, since every upload of the same
+    workbook in the same month resolves to the same sheets.
+    """
+    matched_sheets = []
+    for pattern, sheet_name in _match_dynamic_sheets(tuple(sheet_names), fiscal_quarter_str, fiscal_month_overall_str, fiscal_month_in_quarter_str):
+        if sheet_name is None:
             logging.warning(f"No match found for pattern: {pattern}")
+        else:
+            matched_sheets.append(sheet_name)
 
     return matched_sheets
 
+def map_sheets_to_bases(sheet_names: List[str], base_names: List[str]) -> Dict[str, str]:
+    """
+    Maps each base name (e.g. "Exec View") to the first sheet whose name contains it,
+    in a single pass over the sheets. A sheet is assigned to the first base it contains.
+    The returned dict follows the order of base_names; unmatched bases are left out.
+    """
+    base_to_sheet: Dict[str, str] = {}
+    for sheet_name in sheet_names:
+        for base_name in base_names:
+            if base_name in sheet_name:
+                base_to_sheet.setdefault(base_name, sheet_name)
+                break
+    return {base_name: base_to_sheet[base_name] for base_name in base_names if base_name in base_to_sheet}
+
 def get_dynamic_filename_components() -> Tuple[str, str]:
     """
     Calculates the expected YYYYMM prefix for the source Excel file
@@ -80,8 +105,17 @@ def get_dynamic_filename_components() -> Tuple[str, str]:
     return future_prefix_yyyymm, today_yyyymmdd
 
 def iterate_all_shapes(shapes):
-    """Recursively yields all shapes within a slide or group shape."""
-    for shp in shapes:
-        yield shp
-        if hasattr(shp, "shapes"):
-            yield from iterate_all_shapes(shp.shapes)
\ No newline at end of file
+    """
+    Yields all shapes within a slide or group shape, descending into groups (depth-first, in document order).
+    Walks an explicit stack of iterators instead of recursing, so nested groups do not add generator frames.
+    """
+    stack = [iter(shapes)]
+    while stack:
+        for shp in stack[-1]:
+            yield shp
+            group_shapes = getattr(shp, "shapes", None)
+            if group_shapes is not None:
+                stack.append(iter(group_shapes))
+                break
+        else:
+            stack.pop()
\ No newline at end of file